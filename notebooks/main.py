@@ -1,69 +1,126 @@
+import math
+import mmap
+import os
+import pickle
+import sys
 from pathlib import Path
 import numpy as np
 import matplotlib.pyplot as plt
+import pyfftw
+from numba import njit, prange
 import scienceplots
 from scipy import signal
-import re
+sys.path.insert(0, str(Path('../scripts').resolve()))
+from validate_run import analyze
 plt.style.use(['science','grid'])
 DATA_PATH = Path('../data/processed/TGS_L1_E1_2p048Msps_iq_u8.bin')
 LOG_PATH = Path('../logs/run_fairdata.log')
+WISDOM_PATH = Path('../data/interim/fftw_wisdom.pkl')
 FS_HZ = 2_048_000
 WINDOW_SAMPLES = FS_HZ * 2  # analyze first 2 seconds
 N_PER_SEG = 8192
 N_OVERLAP = 6144
+HOP = N_PER_SEG - N_OVERLAP
 FREQ_DECIMATION = 4
 TIME_DECIMATION = 2
+# ~1 MiB of complex64 frames per FFT batch, whole time-decimation groups only
+BLOCK_FRAMES = TIME_DECIMATION * max(1, (1 << 20) // (N_PER_SEG * 8 * TIME_DECIMATION))
 FIG_DPI = 300
-PRN_PATTERN = re.compile(r"PRN\s+(\d+)\s+Corr:([0-9.]+)\s+f=([+\-0-9.]+)")
 
 def load_iq(path: Path, max_samples: int) -> np.ndarray:
-    data = np.fromfile(path, dtype=np.uint8, count=2 * max_samples)
-    if data.size < 2:
+    size = path.stat().st_size
+    if size < 2:
         raise RuntimeError('File is empty or shorter than requested window')
-    data = (data.astype(np.float32) - 128.0) / 128.0
-    i = data[0::2]
-    q = data[1::2]
-    return (i + 1j * q)[:max_samples]
+    # Map the capture instead of reading it; only the window is ever touched
+    with path.open('rb') as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, 'MADV_SEQUENTIAL'):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    data = np.frombuffer(mm, dtype=np.uint8, count=min(size, 2 * max_samples))
+    # Interleaved I/Q float32 pairs have exactly the complex64 memory layout
+    iq = np.empty(data.size - data.size % 2, dtype=np.float32)
+    np.subtract(data[:iq.size], 128.0, out=iq, dtype=np.float32)
+    iq *= 1.0 / 128.0
+    return iq.view(np.complex64)
 
 
 def parse_prn_log(path: Path) -> dict[int, dict[str, float]]:
-    info = {}
+    # Same Numba byte scanner the run validator uses
     if not path.exists():
-        return info
-    with path.open() as fh:
-        for line in fh:
-            match = PRN_PATTERN.search(line)
-            if match:
-                prn = int(match.group(1))
-                info[prn] = {
-                    'corr': float(match.group(2)),
-                    'doppler_hz': float(match.group(3)),
-                }
-    return info
+        return {}
+    return analyze(path)['prns']
+
+
+def load_wisdom(path: Path) -> None:
+    if path.exists():
+        with path.open('rb') as fh:
+            pyfftw.import_wisdom(pickle.load(fh))
+
+
+def save_wisdom(path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open('wb') as fh:
+        pickle.dump(pyfftw.export_wisdom(), fh)
+
+
+@njit(parallel=True, fastmath=True)
+def power_db_pool(Z, out, f_dec, t_dec):
+    # Max-pool |Z| over f_dec x t_dec cells of the fftshifted grid, with the
+    # shift folded into the row index. The max is taken on |Z|^2, so each
+    # output cell costs one sqrt and one log10.
+    M = Z.shape[0]
+    half = M // 2
+    for nn in prange(out.shape[1]):
+        for mm in range(out.shape[0]):
+            peak = 0.0
+            for n in range(nn * t_dec, min((nn + 1) * t_dec, Z.shape[1])):
+                for s in range(mm * f_dec, min((mm + 1) * f_dec, M)):
+                    m = (s + M - half) % M
+                    re = Z[m, n].real
+                    im = Z[m, n].imag
+                    peak = max(peak, re * re + im * im)
+            out[mm, nn] = 20.0 * math.log10(math.sqrt(peak) + 1e-12)
+
+
+def pooled_centres(n: int, dec: int) -> np.ndarray:
+    # Mean index of each dec-wide pooling cell over range(n), last cell possibly short
+    first = np.arange(0, n, dec)
+    return first + (np.minimum(dec, n - first) - 1) / 2
+
+
+def stft_power_db(iq: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Max-pooled, fftshifted STFT magnitude in dB: (f_kHz, t_s, power)."""
+    frames = np.lib.stride_tricks.sliding_window_view(iq, N_PER_SEG)[::HOP]
+    n_frames = frames.shape[0]
+    # Stream blocks of frames straight into the pooled, shifted dB grid so
+    # neither the complex STFT matrix nor a full-resolution power grid exists.
+    # Max-pooling instead of striding keeps narrow Doppler tones visible.
+    power = np.empty((-(-N_PER_SEG // FREQ_DECIMATION), -(-n_frames // TIME_DECIMATION)), dtype=np.float32)
+    for start in range(0, n_frames, BLOCK_FRAMES):
+        stop = min(start + BLOCK_FRAMES, n_frames)
+        np.multiply(frames[start:stop], WINDOW, out=FFT_PLAN.input_array[:stop - start])
+        cols = slice(start // TIME_DECIMATION, -(-stop // TIME_DECIMATION))
+        power_db_pool(FFT_PLAN()[:stop - start].T, power[:, cols], FREQ_DECIMATION, TIME_DECIMATION)
+    # Cell-centre frequencies in fftshifted order, generated directly instead of shifting
+    f_khz = (pooled_centres(N_PER_SEG, FREQ_DECIMATION) - N_PER_SEG // 2) * (FS_HZ / N_PER_SEG) / 1e3
+    t_s = (N_PER_SEG // 2 + HOP * pooled_centres(n_frames, TIME_DECIMATION)) / FS_HZ
+    return f_khz, t_s, power
+
+
+# Window and FFT plan are built once per session; every STFT call reuses them.
+WINDOW = signal.get_window('hann', N_PER_SEG).astype(np.float32)
+WINDOW /= WINDOW.sum()  # same 'spectrum' scaling as signal.stft
+load_wisdom(WISDOM_PATH)
+FFT_PLAN = pyfftw.builders.fft(
+    pyfftw.empty_aligned((BLOCK_FRAMES, N_PER_SEG), dtype='complex64'),
+    axis=1, threads=os.cpu_count(), planner_effort='FFTW_MEASURE', overwrite_input=True,
+)
 iq = load_iq(DATA_PATH, WINDOW_SAMPLES)
 prn_info = parse_prn_log(LOG_PATH)
 print(f'Loaded {iq.size} IQ samples (first {WINDOW_SAMPLES})')
 print('PRNs from log:', prn_info)
 print('Computing STFT...')
-f, t, Zxx = signal.stft(iq, fs=FS_HZ, nperseg=N_PER_SEG, noverlap=N_OVERLAP, boundary=None, padded=False, return_onesided=False)
-print(f'STFT done: Zxx shape {Zxx.shape}')
-power = 20.0 * np.log10(np.abs(Zxx) + 1e-12)
-print('Computed power spectrum')
-f_shift = np.fft.fftshift(f) / 1e3  # kHz
-t_seconds = t
-power_shift = np.fft.fftshift(power, axes=0).astype(np.float32, copy=False)
-print('Shifted frequency axis for plotting')
-
-# Downsample spectrogram grid to keep plotting memory reasonable
-power_plot = power_shift
-f_plot = f_shift
-t_plot = t_seconds
-if FREQ_DECIMATION > 1:
-    power_plot = power_plot[::FREQ_DECIMATION, :]
-    f_plot = f_plot[::FREQ_DECIMATION]
-if TIME_DECIMATION > 1:
-    power_plot = power_plot[:, ::TIME_DECIMATION]
-    t_plot = t_plot[::TIME_DECIMATION]
+f_plot, t_plot, power_plot = stft_power_db(iq)
 print(f'Plot grid shape after decimation: {power_plot.shape}')
 fig, ax = plt.subplots(figsize=(10, 5))
 mesh = ax.pcolormesh(t_plot, f_plot, power_plot, shading='gouraud', cmap='magma')
@@ -79,4 +136,5 @@ fig.tight_layout()
 print('Saving figure...')
 plt.savefig('stft_with_doppler.png', dpi=FIG_DPI)
 plt.show()
+save_wisdom(WISDOM_PATH)
 print('Done.')
@@ -12,10 +12,15 @@ from pathlib import Path
 from typing import Iterator, Tuple
 
 import numpy as np
+import pyfftw
 import yaml
+from numba import njit, prange
 from scipy import signal
 from tqdm import tqdm
 
+# Samples per independently seeded NCO run in _mix_down.
+MIX_BLOCK = 1024
+
 
 def load_config(path: Path) -> dict:
     with path.open("r", encoding="utf-8") as fh:
@@ -30,11 +35,74 @@ def chunk_reader(handle, chunk_samples: int, dtype: np.dtype) -> Iterator[np.nda
         yield data
 
 
+@njit(parallel=True, fastmath=True)
+def _mix_down(analytic, phase, phase_step, out):
+    """out[i] = analytic[i] * exp(-1j * (phase + i * phase_step)).
+
+    Each MIX_BLOCK run is seeded from the exact phase and then advanced by a
+    complex rotator, so rounding drift never accumulates past one block.
+    """
+    n = analytic.size
+    c = math.cos(-phase_step)
+    s = math.sin(-phase_step)
+    for block in prange((n + MIX_BLOCK - 1) // MIX_BLOCK):
+        start = block * MIX_BLOCK
+        stop = min(start + MIX_BLOCK, n)
+        seed = phase + start * phase_step
+        cr = math.cos(-seed)
+        ci = math.sin(-seed)
+        for i in range(start, stop):
+            a = analytic[i]
+            out[i] = complex(a.real * cr - a.imag * ci, a.real * ci + a.imag * cr)
+            cr, ci = cr * c - ci * s, cr * s + ci * c
+
+
+@njit(parallel=True, fastmath=True)
+def _polyphase(x, bank, up, down, pos, out):
+    """Polyphase FIR resampler core.
+
+    Output r sits at upsampled position n = pos + r * down relative to
+    x[taps - 1]; it is the dot product of arm n % up (stored reversed) with
+    the taps input samples starting at x[n // up].
+    """
+    taps = bank.shape[1]
+    for r in prange(out.size):
+        n = pos + r * down
+        arm = bank[n % up]
+        base = n // up
+        acc = np.complex64(0.0)
+        for s in range(taps):
+            acc += arm[s] * x[base + s]
+        out[r] = acc
+
+
+@njit(fastmath=True)
+def _peak_magnitude(z):
+    """max(abs(z)) without materializing the magnitude array."""
+    peak = 0.0
+    for i in range(z.size):
+        v = z[i].real * z[i].real + z[i].imag * z[i].imag
+        if v > peak:
+            peak = v
+    return math.sqrt(peak)
+
+
+@njit(parallel=True)
+def _saturate(flat, gain, offset, lo, hi, out):
+    """out[i] = rint(clip(flat[i] * gain + offset, lo, hi)) in a single pass."""
+    for i in prange(flat.size):
+        v = flat[i] * gain + offset
+        if v < lo:
+            v = lo
+        elif v > hi:
+            v = hi
+        out[i] = np.rint(v)
+
+
 @dataclass
 class ConverterConfig:
     input_path: Path
     output_path: Path
-    interim_path: Path
     center_freq_hz: float
     target_center_hz: float
     fs_in: float
@@ -63,9 +131,6 @@ class ConverterConfig:
         return cls(
             input_path=(root / sig["input_path"]).resolve(),
             output_path=(root / sig["output_path"]).resolve(),
-            interim_path=(
-                root / sig.get("interim_path", "data/interim/iq.tmp")
-            ).resolve(),
             center_freq_hz=float(sig["center_freq_hz"]),
             target_center_hz=float(sig["target_center_hz"]),
             fs_in=float(sig["fs_in"]),
@@ -86,14 +151,11 @@ class DatConverter:
     def __init__(self, cfg: ConverterConfig):
         self.cfg = cfg
         self.cfg.output_path.parent.mkdir(parents=True, exist_ok=True)
-        self.cfg.interim_path.parent.mkdir(parents=True, exist_ok=True)
         self.cfg.plots_dir.mkdir(parents=True, exist_ok=True)
         self.cfg.logs_dir.mkdir(parents=True, exist_ok=True)
         self.log_file = self.cfg.logs_dir / "convert.log"
-        self.phase = 0.0
         self.max_complex = 1e-9
-        self.total_input_samples = 0
-        self.total_output_samples = 0
+        self._hilbert_plans: dict[int, Tuple[pyfftw.FFTW, pyfftw.FFTW]] = {}
         self.chunk_items = max(
             1, self.cfg.chunk_size_bytes // self.cfg.input_dtype.itemsize
         )
@@ -102,6 +164,19 @@ class DatConverter:
         )
         self.up = frac.numerator
         self.down = frac.denominator
+        # Same Kaiser prototype signal.resample_poly designs, split once into
+        # `up` arms and run with carried-over state so chunk edges are exact.
+        max_rate = max(self.up, self.down)
+        self.filter_delay = 10 * max_rate
+        proto = signal.firwin(
+            2 * self.filter_delay + 1, 1.0 / max_rate, window=("kaiser", 5.0)
+        )
+        taps = -(-proto.size // self.up)
+        padded = np.zeros(taps * self.up)
+        padded[: proto.size] = proto * self.up
+        self.filter_bank = np.ascontiguousarray(
+            padded.reshape(taps, self.up).T[:, ::-1], dtype=np.float32
+        )
         # Rotate spectrum so that the target center ends up at baseband.
         self.phase_step = (
             2.0
@@ -109,6 +184,28 @@ class DatConverter:
             * (self.cfg.target_center_hz - self.cfg.center_freq_hz)
             / self.cfg.fs_in
         )
+        self.hilbert_needed = self.cfg.use_hilbert and self._needs_hilbert()
+        self._reset_stream()
+
+    def _needs_hilbert(self) -> bool:
+        # A real capture carries the whole negative half-band [-fs_in/2, 0]
+        # that the analytic signal would remove. After the NCO shifts by
+        # -shift, that mirrored half-band spans [fs_in/2 - shift, -shift]
+        # (wrapping through +/-fs_in/2), so its edges sit at -shift and
+        # fs_in/2 - shift. Only when both edges stay 0.75 * fs_out clear of DC,
+        # i.e. a quarter output bandwidth past the resampler's cutoff, does the
+        # polyphase filter reject it and the Hilbert transform buy nothing.
+        # A shift <= 0 mixes part of that half-band to DC, so it always needs it.
+        shift = self.cfg.target_center_hz - self.cfg.center_freq_hz
+        margin = 0.75 * self.cfg.fs_out
+        return not margin <= shift <= self.cfg.fs_in / 2 - margin
+
+    def _reset_stream(self) -> None:
+        self.phase = 0.0
+        self.total_input_samples = 0
+        self.total_output_samples = 0
+        self.tail = np.zeros(self.filter_bank.shape[1] - 1, dtype=np.complex64)
+        self.resample_pos = self.filter_delay
 
     def log(self, message: str) -> None:
         stamp = np.datetime64("now").astype("datetime64[ms]").astype(str)
@@ -122,73 +219,124 @@ class DatConverter:
         self.log(
             f"Starting conversion: {self.cfg.input_path} -> {self.cfg.output_path}"
         )
-        with self.cfg.input_path.open("rb") as handle, self.cfg.interim_path.open(
-            "wb"
-        ) as interim:
+        if self.cfg.use_hilbert and not self.hilbert_needed:
+            self.log(
+                "Mixed image falls in the resampler stopband; skipping Hilbert transform"
+            )
+        if self.cfg.iq_gain == "auto":
+            # Auto gain needs the global peak before the first byte is
+            # quantized, so run the DSP once without writing anything.
+            for _ in self._stream("Gain prescan"):
+                pass
+            scale = self.max_complex * 1.05
+        else:
+            scale = float(self.cfg.iq_gain)
+        scale = max(scale, 1e-6)
+        with self.cfg.output_path.open("wb") as out:
+            for complex_block in self._stream("Mix, resample & quantize"):
+                self._to_interleaved(complex_block, scale).tofile(out)
+        self._write_metadata()
+
+    def _stream(self, desc: str) -> Iterator[np.ndarray]:
+        self._reset_stream()
+        with self.cfg.input_path.open("rb") as handle:
             for raw in tqdm(
                 chunk_reader(handle, self.chunk_items, self.cfg.input_dtype),
-                desc="Mix & resample",
+                desc=desc,
                 unit="chunk",
             ):
                 self.total_input_samples += raw.size
                 complex_block = self._process_chunk(raw)
                 if complex_block.size == 0:
                     continue
-                complex_block.astype(np.complex64).tofile(interim)
-        self._quantize()
-        self._write_metadata()
+                yield complex_block
+        complex_block = self._flush()
+        if complex_block.size:
+            yield complex_block
 
     def _process_chunk(self, raw: np.ndarray) -> np.ndarray:
         real = self._normalize_real(raw)
         analytic: np.ndarray
-        if self.cfg.use_hilbert:
-            analytic = signal.hilbert(real)
+        if self.hilbert_needed:
+            analytic = self._analytic(real)
+        elif self.cfg.use_hilbert:
+            # The filter removes the image, so only the 2x positive-band gain
+            # of the analytic signal needs reproducing.
+            analytic = (real * 2.0).astype(np.complex64)
         else:
             analytic = real.astype(np.complex64)
-        phases = self.phase + self.phase_step * np.arange(real.size, dtype=np.float64)
-        oscillators = np.exp(-1j * phases)
-        mixed = analytic * oscillators.astype(np.complex64)
-        self.phase = phases[-1] + self.phase_step
-        resampled = signal.resample_poly(
-            mixed, self.up, self.down, axis=0, padtype="line"
+        mixed = np.empty(real.size, dtype=np.complex64)
+        _mix_down(analytic, self.phase, self.phase_step, mixed)
+        # Wrap the accumulator so long captures keep full float64 phase resolution.
+        self.phase = (self.phase + self.phase_step * real.size) % (2.0 * math.pi)
+        return self._emit(self._resample(mixed))
+
+    def _resample(self, mixed: np.ndarray) -> np.ndarray:
+        x = np.concatenate([self.tail, mixed])
+        span = mixed.size * self.up
+        count = max(0, (span - 1 - self.resample_pos) // self.down + 1)
+        resampled = np.empty(count, dtype=np.complex64)
+        _polyphase(x, self.filter_bank, self.up, self.down, self.resample_pos, resampled)
+        self.resample_pos += count * self.down - span
+        self.tail = x[x.size - self.tail.size :].copy()
+        return resampled
+
+    def _flush(self) -> np.ndarray:
+        # Push zeros through the filter to emit the outputs still held back by
+        # its group delay, up to ceil(samples_in * up / down) in total.
+        expected = -(-self.total_input_samples * self.up // self.down)
+        remaining = expected - self.total_output_samples
+        if remaining <= 0:
+            return np.empty(0, dtype=np.complex64)
+        zeros = np.zeros(
+            remaining * self.down // self.up + self.filter_bank.shape[1],
+            dtype=np.complex64,
         )
+        return self._emit(self._resample(zeros)[:remaining])
+
+    def _emit(self, resampled: np.ndarray) -> np.ndarray:
         if resampled.size == 0:
             return resampled
-        self.max_complex = max(self.max_complex, float(np.max(np.abs(resampled))))
+        self.max_complex = max(self.max_complex, _peak_magnitude(resampled))
         self.total_output_samples += resampled.size
         return resampled
 
-    def _quantize(self) -> None:
-        if self.total_output_samples == 0:
-            self.cfg.output_path.touch()
-            return
-        if self.cfg.iq_gain == "auto":
-            scale = self.max_complex * 1.05
-        else:
-            scale = float(self.cfg.iq_gain)
-        scale = max(scale, 1e-6)
-        dtype = np.complex64
-        total_complex = self.total_output_samples
-        block = max(1, self.cfg.chunk_size_bytes // 8)
-        out_path = self.cfg.output_path
-        interim_path = self.cfg.interim_path
-        if out_path.exists():
-            out_path.unlink()
-        mmap = np.memmap(interim_path, dtype=dtype, mode="r", shape=(total_complex,))
-        with out_path.open("ab") as out:
-            for start in tqdm(
-                range(0, total_complex, block), desc="Quantize", unit="blk"
-            ):
-                stop = min(start + block, total_complex)
-                segment = np.array(mmap[start:stop])
-                iq = np.clip(segment / scale, -1.0, 1.0)
-                interleaved = self._to_interleaved(iq)
-                interleaved.tofile(out)
-        del mmap
-        try:
-            interim_path.unlink()
-        except OSError:
-            pass
+    def _analytic(self, real: np.ndarray) -> np.ndarray:
+        """Analytic signal via one real FFT and one inverse complex FFT."""
+        n = real.size
+        rfft_plan, ifft_plan = self._hilbert_plan(n)
+        rfft_plan.input_array[:] = real
+        half = rfft_plan()
+        spec = ifft_plan.input_array
+        # Same weights as signal.hilbert: DC (and Nyquist for even n) once,
+        # positive bins doubled, negative bins zeroed.
+        spec[: half.size] = half
+        spec[1 : (n + 1) // 2] *= 2.0
+        spec[half.size :] = 0.0
+        return ifft_plan()
+
+    def _hilbert_plan(self, size: int) -> Tuple[pyfftw.FFTW, pyfftw.FFTW]:
+        plans = self._hilbert_plans.get(size)
+        if plans is None:
+            threads = os.cpu_count() or 1
+            # FFTW_MEASURE takes minutes at chunk-sized lengths; the estimate
+            # planner is already well ahead of pocketfft here.
+            rfft_plan = pyfftw.builders.rfft(
+                pyfftw.empty_aligned(size, dtype="float32"),
+                threads=threads,
+                planner_effort="FFTW_ESTIMATE",
+                avoid_copy=True,
+            )
+            ifft_plan = pyfftw.builders.ifft(
+                pyfftw.empty_aligned(size, dtype="complex64"),
+                threads=threads,
+                planner_effort="FFTW_ESTIMATE",
+                avoid_copy=True,
+                overwrite_input=True,
+            )
+            plans = (rfft_plan, ifft_plan)
+            self._hilbert_plans[size] = plans
+        return plans
 
     def _ensure_input_path(self) -> None:
         if self.cfg.input_path.exists():
@@ -214,21 +362,18 @@ class DatConverter:
             return raw.astype(np.float32) / 128.0
         raise ValueError(f"Unsupported input dtype {self.cfg.input_dtype}")
 
-    def _to_interleaved(self, iq: np.ndarray) -> np.ndarray:
+    def _to_interleaved(self, segment: np.ndarray, scale: float) -> np.ndarray:
+        # complex64 already stores I/Q interleaved, so quantize its float32 view.
+        flat = segment.view(np.float32)
         if self.cfg.quantization.lower() == "u8":
-            i = np.round((iq.real + 1.0) * 127.5).astype(np.int16)
-            q = np.round((iq.imag + 1.0) * 127.5).astype(np.int16)
-            i = np.clip(i, 0, 255).astype(np.uint8)
-            q = np.clip(q, 0, 255).astype(np.uint8)
+            out = np.empty(flat.size, dtype=np.uint8)
+            gain = np.float32(127.5 / scale)
+            _saturate(flat, gain, np.float32(127.5), np.float32(0.0), np.float32(255.0), out)
         else:
-            i = np.round(iq.real * 127.0).astype(np.int16)
-            q = np.round(iq.imag * 127.0).astype(np.int16)
-            i = np.clip(i, -128, 127).astype(np.int8)
-            q = np.clip(q, -128, 127).astype(np.int8)
-        interleaved = np.empty(i.size * 2, dtype=i.dtype)
-        interleaved[0::2] = i
-        interleaved[1::2] = q
-        return interleaved
+            out = np.empty(flat.size, dtype=np.int8)
+            gain = np.float32(127.0 / scale)
+            _saturate(flat, gain, np.float32(0.0), np.float32(-127.0), np.float32(127.0), out)
+        return out
 
     def _write_metadata(self) -> None:
         meta = {
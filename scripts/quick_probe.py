@@ -3,12 +3,14 @@
 from __future__ import annotations
 
 import argparse
+import mmap
 from pathlib import Path
 
 import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import numpy as np
+from scipy.fft import rfft, rfftfreq
 
 
 def parse_args() -> argparse.Namespace:
@@ -31,10 +33,15 @@ def main() -> None:
         raise FileNotFoundError(path)
     count = args.samples
     dtype = np.dtype(args.dtype)
-    with path.open("rb") as fh:
-        raw = np.fromfile(fh, dtype=dtype, count=count)
-    if raw.size == 0:
+    available = path.stat().st_size // dtype.itemsize
+    if available == 0:
         raise RuntimeError("No data read from file")
+    # Map the file so only the probed prefix is paged in, never copied.
+    with path.open("rb") as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, "MADV_SEQUENTIAL"):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    raw = np.frombuffer(mm, dtype=dtype, count=min(count, available))
     if dtype == np.dtype("uint8"):
         centered = (raw.astype(np.float32) - 128.0) / 128.0
     elif dtype == np.dtype("int8"):
@@ -52,7 +59,9 @@ def main() -> None:
     for key, value in stats.items():
         print(f"  {key}: {value}")
     fig, ax = plt.subplots(figsize=(6, 4))
-    ax.hist(centered, bins=256, color="steelblue", alpha=0.8)
+    hist, _ = np.histogram(centered, bins=256, range=(-1.0, 1.0))
+    # One bar per 8-bit code: bin k covers [-1 + k/128, -1 + (k+1)/128)
+    ax.bar(np.arange(-128, 128) / 128.0, hist, width=1.0 / 128.0, align="edge", color="steelblue", alpha=0.8)
     ax.set_title("Amplitude histogram (normalized)")
     ax.set_xlabel("Amplitude")
     ax.set_ylabel("Count")
@@ -65,14 +74,14 @@ def main() -> None:
         fft_samples = min(args.fft_size, centered.size)
         if fft_samples < 16:
             raise RuntimeError("Not enough samples for FFT")
-        window = np.hanning(fft_samples)
-        spectrum = np.fft.rfft(centered[:fft_samples] * window)
+        window = np.hanning(fft_samples).astype(np.float32)
+        spectrum = rfft(centered[:fft_samples] * window, workers=-1)
         magnitude = 20.0 * np.log10(np.abs(spectrum) + 1e-12)
         if args.fs:
-            freqs = np.fft.rfftfreq(fft_samples, d=1.0 / args.fs) / 1e6
+            freqs = rfftfreq(fft_samples, d=1.0 / args.fs) / 1e6
             xlabel = "Frequency (MHz)"
         else:
-            freqs = np.fft.rfftfreq(fft_samples, d=1.0)
+            freqs = rfftfreq(fft_samples, d=1.0)
             xlabel = "Normalized frequency (cycles/sample)"
         fig_fft, ax_fft = plt.subplots(figsize=(8, 4))
         ax_fft.plot(freqs, magnitude, color="darkorange", linewidth=1.0)
@@ -4,20 +4,160 @@ from __future__ import annotations
 
 import argparse
 import json
-import re
 import sys
 from pathlib import Path
 
-PRN_PATTERN = re.compile(r"PRN\s+(\d+)\s+Corr:([0-9.]+)\s+f=([+\-0-9.]+)")
-NAV_PATTERNS = [
-    re.compile(r"subframe", re.IGNORECASE),
-    re.compile(r"gpsframe", re.IGNORECASE),
-    re.compile(r"frame\s+lock", re.IGNORECASE),
-]
-EPHEMERIS_PATTERNS = [
-    re.compile(r"ephem", re.IGNORECASE),
-    re.compile(r"ephemeris", re.IGNORECASE),
-]
+import numpy as np
+from numba import njit
+
+# Byte patterns for _scan_log. Keywords are stored lowercase and matched
+# case-insensitively; the PRN line pieces and task markers are exact.
+_PRN = np.frombuffer(b"PRN", dtype=np.uint8)
+_CORR = np.frombuffer(b"Corr:", dtype=np.uint8)
+_FREQ = np.frombuffer(b"f=", dtype=np.uint8)
+_SUBFRAME = np.frombuffer(b"subframe", dtype=np.uint8)
+_GPSFRAME = np.frombuffer(b"gpsframe", dtype=np.uint8)
+_FRAME = np.frombuffer(b"frame", dtype=np.uint8)
+_LOCK = np.frombuffer(b"lock", dtype=np.uint8)
+_EPHEM = np.frombuffer(b"ephem", dtype=np.uint8)
+_TASK1 = np.frombuffer(b"Task1 finished", dtype=np.uint8)
+_TASK2 = np.frombuffer(b"Task2 finished", dtype=np.uint8)
+
+
+@njit(cache=True)
+def _match(buf, pos, word, fold):
+    if pos + word.size > buf.size:
+        return False
+    for k in range(word.size):
+        c = buf[pos + k]
+        if fold:
+            c |= 0x20  # ASCII lowercase; only letters can fold onto letters
+        if c != word[k]:
+            return False
+    return True
+
+
+@njit(cache=True)
+def _skip_blank(buf, pos):
+    # Whitespace that cannot end a line: space, \t, \v, \f. The old text-mode
+    # reader split lines on both \n and \r, so neither counts as a blank.
+    while pos < buf.size and (buf[pos] == 32 or buf[pos] == 9 or buf[pos] == 11 or buf[pos] == 12):
+        pos += 1
+    return pos
+
+
+@njit(cache=True)
+def _skip_number(buf, pos, signed):
+    # [0-9.]+, or [+\-0-9.]+ when signed
+    while pos < buf.size:
+        c = buf[pos]
+        if not (48 <= c <= 57 or c == 46 or (signed and (c == 43 or c == 45))):
+            break
+        pos += 1
+    return pos
+
+
+@njit(cache=True)
+def _match_prn(buf, pos, fields):
+    """Match PRN\\s+(\\d+)\\s+Corr:([0-9.]+)\\s+f=([+\\-0-9.]+) at pos.
+
+    Fills fields with the (start, stop) offsets of the three groups and returns
+    the end of the match, or -1.
+    """
+    if not _match(buf, pos, _PRN, False):
+        return -1
+    start = pos + 3
+    pos = _skip_blank(buf, start)
+    if pos == start:
+        return -1
+    fields[0] = pos
+    while pos < buf.size and 48 <= buf[pos] <= 57:
+        pos += 1
+    fields[1] = pos
+    start = pos
+    pos = _skip_blank(buf, start)
+    if fields[1] == fields[0] or pos == start or not _match(buf, pos, _CORR, False):
+        return -1
+    fields[2] = pos + _CORR.size
+    pos = _skip_number(buf, fields[2], False)
+    fields[3] = pos
+    start = pos
+    pos = _skip_blank(buf, start)
+    if fields[3] == fields[2] or pos == start or not _match(buf, pos, _FREQ, False):
+        return -1
+    fields[4] = pos + _FREQ.size
+    pos = _skip_number(buf, fields[4], True)
+    fields[5] = pos
+    if fields[5] == fields[4]:
+        return -1
+    return pos
+
+
+@njit(cache=True)
+def _scan_log(buf):
+    """Single pass over the raw log bytes.
+
+    Returns (spans, subframes, ephemeris, task1, task2) where each row of
+    spans holds the byte offsets of one PRN line's prn/corr/doppler fields.
+    Lines end at \n or \r, as with universal newlines. Only the first PRN
+    match on a line is recorded, and navigation and ephemeris hits count
+    lines, not keyword occurrences.
+    """
+    spans = np.empty((64, 6), dtype=np.int64)
+    fields = np.empty(6, dtype=np.int64)
+    hits = 0
+    subframes = 0
+    ephemeris = 0
+    task1 = False
+    task2 = False
+    prn_line = False
+    nav_line = False
+    ephem_line = False
+    pos = 0
+    while pos < buf.size:
+        c = buf[pos]
+        if c == 10 or c == 13:
+            prn_line = False
+            nav_line = False
+            ephem_line = False
+            pos += 1
+            continue
+        if c == 80 and not prn_line:  # 'P'
+            end = _match_prn(buf, pos, fields)
+            if end >= 0:
+                if hits == spans.shape[0]:
+                    grown = np.empty((2 * hits, 6), dtype=np.int64)
+                    grown[:hits] = spans
+                    spans = grown
+                spans[hits] = fields
+                hits += 1
+                prn_line = True
+                pos = end
+                continue
+        elif c == 84:  # 'T'
+            if _match(buf, pos, _TASK1, False):
+                task1 = True
+            elif _match(buf, pos, _TASK2, False):
+                task2 = True
+        lower = c | 0x20
+        if not nav_line:
+            if (
+                (lower == 115 and _match(buf, pos, _SUBFRAME, True))
+                or (lower == 103 and _match(buf, pos, _GPSFRAME, True))
+                or (
+                    lower == 102
+                    and _match(buf, pos, _FRAME, True)
+                    and _skip_blank(buf, pos + 5) > pos + 5
+                    and _match(buf, _skip_blank(buf, pos + 5), _LOCK, True)
+                )
+            ):
+                nav_line = True
+                subframes += 1
+        if not ephem_line and lower == 101 and _match(buf, pos, _EPHEM, True):
+            ephem_line = True
+            ephemeris += 1
+        pos += 1
+    return spans[:hits], subframes, ephemeris, task1, task2
 
 
 def parse_args() -> argparse.Namespace:
@@ -39,22 +179,16 @@ def analyze(log_path: Path) -> dict:
     ephemeris = 0
     if not log_path.exists():
         raise FileNotFoundError(log_path)
-    with log_path.open("r", encoding="utf-8", errors="ignore") as fh:
-        for line in fh:
-            match = PRN_PATTERN.search(line)
-            if match:
-                prn = int(match.group(1))
-                corr = float(match.group(2))
-                freq = float(match.group(3))
-                prns[prn] = {"corr": corr, "doppler_hz": freq}
-            if "Task1 finished" in line:
-                task1 = True
-            if "Task2 finished" in line:
-                task2 = True
-            if any(p.search(line) for p in NAV_PATTERNS):
-                subframes += 1
-            if any(p.search(line) for p in EPHEMERIS_PATTERNS):
-                ephemeris += 1
+    # mmap refuses empty files, and an empty log has nothing to count anyway.
+    if log_path.stat().st_size > 0:
+        buf = np.memmap(log_path, dtype=np.uint8, mode="r")
+        spans, subframes, ephemeris, task1, task2 = _scan_log(buf)
+        for p0, p1, c0, c1, f0, f1 in spans.tolist():
+            prns[int(buf[p0:p1].tobytes())] = {
+                "corr": float(buf[c0:c1].tobytes()),
+                "doppler_hz": float(buf[f0:f1].tobytes()),
+            }
+        del buf
     return {"prns": prns, "task1": task1, "task2": task2, "subframes": subframes, "ephemeris": ephemeris}
 
 
@@ -113,7 +113,7 @@ Write-Host "Installing GPS-SDR-Receiver requirements"
 Invoke-Checked -Exe $pythonBin -Args @('-m', 'pip', 'install', '-r', $requirements) -ErrorMessage 'Failed to install GPS-SDR-Receiver requirements.'
 
 Write-Host "Installing workspace python dependencies"
-Invoke-Checked -Exe $pythonBin -Args @('-m', 'pip', 'install', 'numpy', 'scipy', 'matplotlib', 'tqdm', 'pyyaml') -ErrorMessage 'Failed to install workspace dependencies.'
+Invoke-Checked -Exe $pythonBin -Args @('-m', 'pip', 'install', 'numpy', 'scipy', 'matplotlib', 'tqdm', 'pyyaml', 'pyfftw', 'numba') -ErrorMessage 'Failed to install workspace dependencies.'
 
 }
 finally {